@@ -296,8 +296,10 @@ def parse_enum(arch, e):
 
   return Type.enumeration(width=elem_size, members=members)
 
-# Returns None if the type is still incomplete,
-# i.e. members have types that aren't yet in parsed_structs
+# Returns type,missing_names
+# type is None if the type is still incomplete, i.e. members have types
+# that aren't yet in parsed_structs. missing_names are the type names
+# that need to be defined before trying again.
 def parse_struct(bv, arch, s, types, is_union=False):
   # We can only generate this type if all the subtypes are known
   missing_types = []
@@ -328,17 +330,51 @@ def parse_struct(bv, arch, s, types, is_union=False):
 
   if len(missing_types) != 0:
     log.log(0, f"Unable to parse struct {s.name}, missing {missing_types}")
-    return None
+    return None, { typename for typename,_ in missing_types }
 
   if is_union:
-    return Type.union(members=members)
+    return Type.union(members=members), set()
   else:
-    return Type.structure(members=members)
+    return Type.structure(members=members), set()
+
+
+
 
+# Returns the set of type names that m needs to be completely defined
+# before it can be used, i.e. types that are embedded by value.
+# This has to match what resolve_type needs a firm typeref for.
+def type_dependencies(m):
+  if not hasattr(m, "leaf_type"):
+    return set()
+
+  if m.leaf_type == "LF_MEMBER":
+    return type_dependencies(m.index)
 
+  elif m.leaf_type in [ "LF_STRUCTURE", "LF_UNION", "LF_ENUM" ]:
+    return { m.name }
+
+  elif m.leaf_type == "LF_ARRAY":
+    return type_dependencies(m.element_type)
+
+  # Pointers are fine with a loose reference, everything else is builtin
+  # or resolved to void by resolve_type.
+  return set()
+
+# Dependencies of a whole struct or union, excluding itself
+def record_dependencies(s):
+  deps = set()
+  for m in s.fieldlist.substructs:
+    if hasattr(m, "offset"):
+      deps |= type_dependencies(m)
+  deps.discard(s.name)
+  return deps
 
 
 # Returns a dictionary of name -> type
+#
+# Each type is defined as soon as all the types it embeds by value have been
+# defined. Types that come up early wait for their missing dependencies
+# instead of being retried in a full pass over everything that's left.
 def load_pdb(bv, path):
   types = { "struct": {}, "enum": {}, "union": {} }
 
@@ -352,76 +388,119 @@ def load_pdb(bv, path):
   # TODO: Determine from PDB
   arch = Architecture['x86_64']
 
+  # The PDB may contain duplicate types. That's part of the deal.
+  # We only care about the latest version of each type, though.
+  enums = {}
+  structs = {}
+  for t in pdb.streams[pp.PDB_STREAM_TPI].types.values():
+    if t.leaf_type == "LF_ENUM" and not t.prop.fwdref:
+      enums[t.name] = t
+    elif (t.leaf_type == "LF_STRUCTURE" or t.leaf_type == "LF_UNION") and not t.prop.fwdref:
+      structs[t.name] = t
 
-  structs = [
-               s for s in pdb.streams[pp.PDB_STREAM_TPI].types.values()
-               if (s.leaf_type == "LF_STRUCTURE" or s.leaf_type == "LF_UNION") and not s.prop.fwdref
-            ]
+  # Names of the types that are defined in the view
+  committed = set()
 
-  enums = [
-               e for e in pdb.streams[pp.PDB_STREAM_TPI].types.values()
-               if e.leaf_type == "LF_ENUM" and not e.prop.fwdref
-          ]
+  # type name -> records waiting for it to be defined
+  waiting = {}
 
+  # id(record) -> (record, set of names it's still waiting for)
+  parked = {}
 
-  # The PDB may contain duplicate types. That's part of the deal.
-  # We only care about the latest version of each type, though.
+  n_enums = 0
+  n_parsed_structs = 0
+  n_failed = 0
+
+  # Defines the record in the view.
+  # Returns success,missing_names
+  def commit(s):
+    if s.leaf_type == "LF_ENUM":
+      log.log(0, f"Parsing enum {s.name}")
+      et = parse_enum(arch, s)
+      if et is None:
+        log.log(1, f"Unable to parse enum {s.name}.")
+        return False, set()
+
+      # Add the type to the binja project
+      bv.define_user_type(s.name, et)
+
+      # Create a named reference for others to use this structure as a member
+      typeclass = NamedTypeReferenceClass["EnumNamedTypeClass"]
+      ltr = Type.named_type_reference(type_class=typeclass, name=s.name)
+      types["enum"][s.name] = ltr
+      return True, set()
 
-  for e in enums:
-    log.log(0, f"Parsing enum {e.name}")
-    et = parse_enum(arch, e)
-    if et is None:
-      log.log(1, f"Unable to parse enum {e.name}.")
-      continue
+    if s.leaf_type == "LF_STRUCTURE":
+      log.log(0, f"Parsing struct {s.name}")
+      p, missing = parse_struct(bv, arch, s, types, is_union=False)
+    else:
+      log.log(0, f"Parsing union {s.name}")
+      p, missing = parse_struct(bv, arch, s, types, is_union=True)
+
+    if p is None:
+      return False, missing
 
     # Add the type to the binja project
-    bv.define_user_type(e.name, et)
+    bv.define_user_type(s.name, p)
 
     # Create a named reference for others to use this structure as a member
-    typeclass = NamedTypeReferenceClass["EnumNamedTypeClass"]
-    ltr = Type.named_type_reference(type_class=typeclass, name=e.name)
-    types["enum"][e.name] = ltr
+    types["struct"][s.name] = p
+    return True, set()
+
+  # Come back to this one once everything it's missing is defined
+  def park(s, missing):
+    parked[id(s)] = (s, missing)
+    for name in missing:
+      waiting.setdefault(name, []).append(s)
+
+  worklist = list(enums.values()) + list(structs.values())
+  worklist.reverse()
+  while len(worklist) > 0:
+    s = worklist.pop()
+
+    missing = record_dependencies(s) - committed
+    if len(missing) > 0:
+      park(s, missing)
+      continue
 
-  n_parsed_structs = 0
-  iteration_structs = -1
-  while len(structs) > 0 and iteration_structs != 0:
-    iteration_structs = 0
-    remaining_structs = []
-    for s in structs:
-      #if "unnamed_143b" not in s.name: continue
-      p = None
-      if s.leaf_type == "LF_STRUCTURE":
-        log.log(0, f"Parsing struct {s.name}")
-        #print(s)
-        p = parse_struct(bv, arch, s, types, is_union=False)
-        #typeclass = NamedTypeReferenceClass["StructNamedTypeClass"]
-
-      elif s.leaf_type == "LF_UNION":
-        log.log(0, f"Parsing union {s.name}")
-        p = parse_struct(bv, arch, s, types, is_union=True)
-        #typeclass = NamedTypeReferenceClass["UnionNamedTypeClass"]
-
-      if p is not None:
-        iteration_structs += 1
-
-        # Add the type to the binja project
-        bv.define_user_type(s.name, p)
-
-        # Create a named reference for others to use this structure as a member
-        types["struct"][s.name] = p
+    ok, missing = commit(s)
+    if not ok:
+      # Our dependencies didn't match what parse_struct needed.
+      # Wait for the ones it actually reported, if they can still show up.
+      missing = missing - committed
+      if len(missing) > 0:
+        park(s, missing)
       else:
-        remaining_structs.append(s)
-
-    # Discard the ones we've successfully parsed out
-    structs = remaining_structs
-    log.log(0, f"{len(structs)} incomplete structs left to parse...")
-
-    n_parsed_structs += iteration_structs
-    log.log(1, f"{n_parsed_structs} structures parsed from PDB.")
+        n_failed += 1
+      continue
 
-  log.log(1, f"{len(enums)} enums parsed from PDB.")
-  if len(structs) > 0:
-    log.log(2, f"{len(structs)} not parsed due to incomplete info. This is probably a bug in the script.")
+    if s.leaf_type == "LF_ENUM":
+      n_enums += 1
+    else:
+      n_parsed_structs += 1
+      if n_parsed_structs % 100 == 0:
+        log.log(1, f"{n_parsed_structs} structures parsed from PDB.")
+
+    committed.add(s.name)
+
+    # Anything that was only waiting for this one goes next
+    for w in waiting.pop(s.name, []):
+      if id(w) not in parked:
+        continue
+      _, wmissing = parked[id(w)]
+      wmissing.discard(s.name)
+      if len(wmissing) == 0:
+        del parked[id(w)]
+        worklist.append(w)
+
+  log.log(1, f"{n_parsed_structs} structures parsed from PDB.")
+  log.log(1, f"{n_enums} enums parsed from PDB.")
+
+  for s, missing in parked.values():
+    log.log(0, f"Unable to parse {s.name}, missing {sorted(missing)}")
+
+  if n_failed + len(parked) > 0:
+    log.log(2, f"{n_failed + len(parked)} not parsed due to incomplete info. This is probably a bug in the script.")
 
   return types
 